@@ -0,0 +1,6 @@
+from web_app import MAX_CONCURRENCY, MAX_QUEUE_DEPTH
+
+# Admission control in web_app.py is per worker and needs a thread for every
+# in-flight request plus every queued one.
+worker_class = "gthread"
+threads = MAX_CONCURRENCY + MAX_QUEUE_DEPTH
@@ -0,0 +1,245 @@
+import importlib
+import os
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+import web_app
+
+
+OWM_PAYLOAD = {
+    "coord": {"lat": 48.85, "lon": 2.35},
+    "name": "Paris",
+    "sys": {"country": "FR", "sunrise": 1, "sunset": 2},
+    "weather": [{"description": "clear sky"}],
+    "main": {"temp": 20, "feels_like": 19, "humidity": 40},
+    "wind": {"speed": 3.2, "deg": 90},
+    "hourly": {"us_aqi": [42], "pm2_5": [7.5]},
+    "current": {"uv_index": 4.1},
+}
+
+
+class FakeResponse:
+    status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return OWM_PAYLOAD
+
+
+@pytest.fixture(autouse=True)
+def fresh_admission(monkeypatch):
+    controller = web_app.AdmissionController()
+    monkeypatch.setattr(web_app, "admission", controller)
+    web_app.stale_cache.clear()
+    yield controller
+    web_app.stale_cache.clear()
+
+
+@pytest.fixture
+def client():
+    return web_app.app.test_client()
+
+
+# --- acquire / shed / timeout ---
+
+def test_acquire_admits_up_to_limit(fresh_admission):
+    fresh_admission.limit = 2
+    assert fresh_admission.acquire()
+    assert fresh_admission.acquire()
+    assert fresh_admission.in_flight == 2
+
+
+def test_acquire_sheds_immediately_when_queue_full(fresh_admission, monkeypatch):
+    monkeypatch.setattr(web_app, "MAX_QUEUE_DEPTH", 0)
+    fresh_admission.limit = 1
+    assert fresh_admission.acquire()
+
+    start = time.monotonic()
+    assert not fresh_admission.acquire()
+    assert time.monotonic() - start < 0.05
+    assert fresh_admission.rejected_total == 1
+    assert fresh_admission.queue_wait_count["shed"] == 1
+
+
+def test_acquire_times_out_and_records_wait(fresh_admission, monkeypatch):
+    monkeypatch.setattr(web_app, "QUEUE_TIMEOUT", 0.1)
+    fresh_admission.limit = 1
+    assert fresh_admission.acquire()
+
+    assert not fresh_admission.acquire()
+    assert fresh_admission.queued == 0
+    assert fresh_admission.queue_wait_count["shed"] == 1
+    assert fresh_admission.queue_wait_sum["shed"] >= 0.1
+
+
+def test_queued_request_admitted_on_release(fresh_admission, monkeypatch):
+    monkeypatch.setattr(web_app, "QUEUE_TIMEOUT", 2.0)
+    fresh_admission.limit = 1
+    assert fresh_admission.acquire()
+
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(fresh_admission.acquire()))
+    waiter.start()
+    time.sleep(0.05)
+    fresh_admission.release(0.01, True)
+    waiter.join(timeout=1)
+
+    assert result == [True]
+    assert fresh_admission.queue_wait_count["admitted"] == 2
+
+
+# --- AIMD limit ---
+
+def test_fast_completions_raise_limit(fresh_admission):
+    fresh_admission.limit = 4
+    for _ in range(4):
+        fresh_admission.acquire()
+    # Only the completions that leave at least half the limit busy count.
+    for _ in range(4):
+        fresh_admission.release(0.01, True)
+    assert 4.6 < fresh_admission.limit < 5
+
+
+def test_sequential_fast_traffic_leaves_limit_unchanged(fresh_admission):
+    fresh_admission.limit = 8
+    for _ in range(600):
+        assert fresh_admission.acquire()
+        fresh_admission.release(0.01, True)
+    assert fresh_admission.limit == 8
+
+
+def test_limit_capped_at_max(fresh_admission):
+    fresh_admission.limit = web_app.MAX_CONCURRENCY
+    fresh_admission.acquire()
+    fresh_admission.release(0.01, True)
+    assert fresh_admission.limit == web_app.MAX_CONCURRENCY
+
+
+def test_slow_burst_backs_off_once_per_window(fresh_admission):
+    fresh_admission.limit = 8
+    for _ in range(8):
+        fresh_admission.acquire()
+    for _ in range(8):
+        fresh_admission.release(web_app.LATENCY_TARGET + 1, True)
+    assert fresh_admission.limit == 8 * web_app.BACKOFF_FACTOR
+
+
+def test_failures_back_off_again_after_window(fresh_admission):
+    fresh_admission.limit = 8
+    # The first failure backs off; the next one is only honoured after the
+    # eight completions that make up the window.
+    for _ in range(9):
+        assert fresh_admission.acquire()
+        fresh_admission.release(0.01, False)
+    assert fresh_admission.in_flight == 0
+    assert fresh_admission.limit == 8 * web_app.BACKOFF_FACTOR ** 2
+
+
+def test_limit_never_drops_below_min(fresh_admission, monkeypatch):
+    monkeypatch.setattr(web_app, "MIN_CONCURRENCY", 4)
+    fresh_admission.limit = 5
+    fresh_admission.acquire()
+    fresh_admission.release(web_app.LATENCY_TARGET + 1, False)
+    assert fresh_admission.limit == web_app.MIN_CONCURRENCY
+
+
+# --- /api/weather through the test client ---
+
+def test_weather_admitted_and_cached(client, fresh_admission):
+    with mock.patch.object(web_app.requests, "get", return_value=FakeResponse()):
+        response = client.get("/api/weather?city=Paris")
+    assert response.status_code == 200
+    assert response.get_json()["locationName"] == "Paris, FR"
+    assert "paris" in web_app.stale_cache
+    assert fresh_admission.in_flight == 0
+
+
+def test_missing_city_skips_admission(client, fresh_admission):
+    fresh_admission.limit = 1
+    fresh_admission.acquire()
+    for url in ("/api/weather", "/api/weather?city=%20%20"):
+        response = client.get(url)
+        assert response.status_code == 400
+        assert response.get_json()["error"] == "A 'city' query parameter is required."
+    assert fresh_admission.admitted_total == 1
+    assert fresh_admission.limit == 1
+
+
+def test_shed_serves_stale_answer(client, fresh_admission):
+    with mock.patch.object(web_app.requests, "get", return_value=FakeResponse()):
+        client.get("/api/weather?city=Paris")
+
+    with mock.patch.object(fresh_admission, "acquire", return_value=False):
+        response = client.get("/api/weather?city=paris")
+    assert response.status_code == 200
+    assert response.headers["Warning"] == '110 - "Response is Stale"'
+    assert int(response.headers["Age"]) >= 0
+    assert "Retry-After" not in response.headers
+    assert response.get_json()["locationName"] == "Paris, FR"
+    assert fresh_admission.stale_served_total == 1
+
+
+def test_shed_without_cache_returns_503(client, fresh_admission):
+    with mock.patch.object(fresh_admission, "acquire", return_value=False), \
+            mock.patch.object(web_app.requests, "get") as upstream:
+        response = client.get("/api/weather?city=Rome")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(web_app.RETRY_AFTER_SECONDS)
+    assert "Warning" not in response.headers
+    upstream.assert_not_called()
+
+
+def test_shed_ignores_expired_cache(client, fresh_admission, monkeypatch):
+    web_app.remember_response("paris", {"locationName": "Paris, FR"})
+    monkeypatch.setattr(web_app, "STALE_MAX_AGE", -1)
+    with mock.patch.object(fresh_admission, "acquire", return_value=False):
+        response = client.get("/api/weather?city=Paris")
+    assert response.status_code == 503
+
+
+def test_metrics_labelled_by_worker(client):
+    with mock.patch.object(web_app.requests, "get", return_value=FakeResponse()):
+        client.get("/api/weather?city=Paris")
+    body = client.get("/metrics").get_data(as_text=True)
+    worker = f'worker="{os.getpid()}"'
+    assert f"weather_admission_admitted_total{{{worker}}} 1\n" in body
+    assert f"weather_admission_rejected_total{{{worker}}} 0\n" in body
+    assert f'weather_admission_queue_wait_seconds_count{{{worker},result="admitted"}} 1\n' in body
+    assert f'weather_admission_queue_wait_seconds_count{{{worker},result="shed"}} 0\n' in body
+
+
+def test_env_limits_are_clamped(monkeypatch):
+    env = {
+        "MIN_CONCURRENCY": "0",
+        "MAX_CONCURRENCY": "4",
+        "INITIAL_CONCURRENCY": "999",
+        "MAX_QUEUE_DEPTH": "-2",
+        "QUEUE_TIMEOUT": "-1",
+        "UPSTREAM_TIMEOUT": "0",
+        "LATENCY_TARGET": "-1",
+        "RETRY_AFTER_SECONDS": "-5",
+        "STALE_MAX_AGE": "-5",
+    }
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    try:
+        importlib.reload(web_app)
+        assert web_app.MIN_CONCURRENCY == 1
+        assert web_app.MAX_CONCURRENCY == 4
+        assert web_app.INITIAL_CONCURRENCY == 4
+        assert web_app.MAX_QUEUE_DEPTH == 0
+        assert web_app.QUEUE_TIMEOUT == 0
+        assert web_app.UPSTREAM_TIMEOUT == 0.1
+        assert web_app.LATENCY_TARGET == 0.1
+        assert web_app.RETRY_AFTER_SECONDS == 0
+        assert web_app.STALE_MAX_AGE == 0
+        assert web_app.admission.limit == 4
+    finally:
+        for name in env:
+            monkeypatch.delenv(name)
+        importlib.reload(web_app)
@@ -3,6 +3,10 @@ import json
 from flask import Flask, request, jsonify, Response
 from datetime import datetime, timedelta, timezone
 import os # Import os to get the port from the environment
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
 
 # --- 1. PYTHON BACKEND LOGIC (using Flask) ---
 
@@ -14,6 +18,27 @@ OWM_WEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
 OM_AQI_URL = "https://air-quality-api.open-meteo.com/v1/air-quality"
 OM_UV_URL = "https://api.open-meteo.com/v1/forecast"
 UNITS = "metric"
+UPSTREAM_TIMEOUT = max(0.1, float(os.environ.get('UPSTREAM_TIMEOUT', 5)))  # seconds per upstream call; requests rejects 0
+
+# --- Admission Control Configuration (per worker process) ---
+# gunicorn caps each worker at `threads` concurrent requests and a request
+# waiting in our queue still holds one of them, so a worker needs
+# threads >= MAX_CONCURRENCY + MAX_QUEUE_DEPTH for the limit and queue to mean
+# anything. gunicorn.conf.py sizes the gthread pool from these values.
+# A limit of 0 would shed everything forever (nothing in flight ever releases),
+# so the floor is always at least one slot and the starting limit sits in range.
+MIN_CONCURRENCY = max(1, int(os.environ.get('MIN_CONCURRENCY', 1)))
+MAX_CONCURRENCY = max(MIN_CONCURRENCY, int(os.environ.get('MAX_CONCURRENCY', 32)))
+INITIAL_CONCURRENCY = min(MAX_CONCURRENCY, max(MIN_CONCURRENCY, int(os.environ.get('INITIAL_CONCURRENCY', 8))))
+MAX_QUEUE_DEPTH = max(0, int(os.environ.get('MAX_QUEUE_DEPTH', 16)))
+QUEUE_TIMEOUT = max(0.0, float(os.environ.get('QUEUE_TIMEOUT', 1.0)))  # max seconds a request waits for a slot
+LATENCY_TARGET = max(0.1, float(os.environ.get('LATENCY_TARGET', 1.5)))  # upstream latency (s) above which we back off
+BACKOFF_FACTOR = 0.75  # multiplicative decrease on slow/failed upstream calls
+RETRY_AFTER_SECONDS = max(0, int(os.environ.get('RETRY_AFTER_SECONDS', 2)))
+STALE_MAX_AGE = max(0, int(os.environ.get('STALE_MAX_AGE', 3600)))  # oldest cached answer we serve when shedding
+STALE_CACHE_SIZE = 1024
+QUEUE_WAIT_BUCKETS = tuple(sorted({0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, QUEUE_TIMEOUT}))
+QUEUE_WAIT_RESULTS = ('admitted', 'shed')
 
 # --- Python Helper Functions ---
 def deg_to_cardinal(deg):
@@ -21,17 +46,182 @@ def deg_to_cardinal(deg):
     arr = ["N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE", "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW"]
     return arr[(val % 16)]
 
+# --- Admission Control (bounded queue + AIMD concurrency limit) ---
+class AdmissionController:
+    """Limits in-flight upstream work and sheds load once the queue is full.
+
+    The concurrency limit grows by roughly one slot per "round" of fast
+    responses and shrinks multiplicatively, at most once per window, when the
+    upstreams get slow or fail.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.limit = float(INITIAL_CONCURRENCY)
+        self.backoff_cooldown = 0  # completions left before another decrease is allowed
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.stale_served_total = 0
+        # Queue wait is tracked separately for admitted and shed requests so the
+        # longest waits (the ones that timed out) still show up under overload.
+        self.queue_wait_sum = dict.fromkeys(QUEUE_WAIT_RESULTS, 0.0)
+        self.queue_wait_count = dict.fromkeys(QUEUE_WAIT_RESULTS, 0)
+        self.queue_wait_buckets = {result: [0] * len(QUEUE_WAIT_BUCKETS) for result in QUEUE_WAIT_RESULTS}
+
+    def acquire(self):
+        """Returns True once a slot is held, False if the request should be shed."""
+        start = time.monotonic()
+        with self.cond:
+            if self.in_flight >= int(self.limit):
+                if self.queued >= MAX_QUEUE_DEPTH:
+                    self.rejected_total += 1
+                    self._observe_queue_wait('shed', time.monotonic() - start)
+                    return False
+                self.queued += 1
+                deadline = start + QUEUE_TIMEOUT
+                try:
+                    while self.in_flight >= int(self.limit):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected_total += 1
+                            self._observe_queue_wait('shed', time.monotonic() - start)
+                            return False
+                        self.cond.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self.in_flight += 1
+            self.admitted_total += 1
+            self._observe_queue_wait('admitted', time.monotonic() - start)
+            return True
+
+    def release(self, latency, upstream_ok):
+        with self.cond:
+            # Only grow the limit while at least half of it is in use; otherwise
+            # a quiet period ratchets it up to MAX_CONCURRENCY untested.
+            in_use = self.in_flight >= int(self.limit) / 2
+            self.in_flight -= 1
+            if self.backoff_cooldown > 0:
+                self.backoff_cooldown -= 1
+            if upstream_ok and latency <= LATENCY_TARGET:
+                if in_use:
+                    self.limit = min(MAX_CONCURRENCY, self.limit + 1.0 / self.limit)
+            elif self.backoff_cooldown == 0:
+                # Requests already in flight during a slowdown all finish slowly
+                # together; back off once, then wait for a limit's worth of
+                # completions before treating another slow one as new congestion.
+                self.backoff_cooldown = int(self.limit)
+                self.limit = max(MIN_CONCURRENCY, self.limit * BACKOFF_FACTOR)
+            self.cond.notify_all()
+
+    def _observe_queue_wait(self, result, seconds):
+        self.queue_wait_sum[result] += seconds
+        self.queue_wait_count[result] += 1
+        buckets = self.queue_wait_buckets[result]
+        for i, bound in enumerate(QUEUE_WAIT_BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+
+    def metrics_text(self):
+        # State is per worker process and a scrape lands on whichever worker
+        # gunicorn picks, so every series carries the worker's pid; aggregate
+        # with e.g. sum without (worker) (...).
+        worker = f'worker="{os.getpid()}"'
+        with self.cond:
+            lines = [
+                "# TYPE weather_admission_queue_wait_seconds histogram",
+            ]
+            for result in QUEUE_WAIT_RESULTS:
+                labels = f'{worker},result="{result}"'
+                for bound, count in zip(QUEUE_WAIT_BUCKETS, self.queue_wait_buckets[result]):
+                    lines.append(f'weather_admission_queue_wait_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines += [
+                    f'weather_admission_queue_wait_seconds_bucket{{{labels},le="+Inf"}} {self.queue_wait_count[result]}',
+                    f'weather_admission_queue_wait_seconds_sum{{{labels}}} {self.queue_wait_sum[result]:.6f}',
+                    f'weather_admission_queue_wait_seconds_count{{{labels}}} {self.queue_wait_count[result]}',
+                ]
+            for name, kind, value in (
+                ("concurrency_limit", "gauge", int(self.limit)),
+                ("in_flight", "gauge", self.in_flight),
+                ("queued", "gauge", self.queued),
+                ("admitted_total", "counter", self.admitted_total),
+                ("rejected_total", "counter", self.rejected_total),
+                ("stale_served_total", "counter", self.stale_served_total),
+            ):
+                lines.append(f"# TYPE weather_admission_{name} {kind}")
+                lines.append(f"weather_admission_{name}{{{worker}}} {value}")
+        return "\n".join(lines) + "\n"
+
+admission = AdmissionController()
+
+# Last good answer per city, used when we shed a request.
+stale_cache = OrderedDict()
+stale_cache_lock = threading.Lock()
+
+def remember_response(city_key, data):
+    with stale_cache_lock:
+        stale_cache[city_key] = (time.time(), data)
+        stale_cache.move_to_end(city_key)
+        while len(stale_cache) > STALE_CACHE_SIZE:
+            stale_cache.popitem(last=False)
+
+def lookup_stale(city_key):
+    with stale_cache_lock:
+        entry = stale_cache.get(city_key)
+    if entry is None or time.time() - entry[0] > STALE_MAX_AGE:
+        return None
+    return entry
+
+def admission_controlled(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        city_key = (request.args.get('city') or '').strip().lower()
+        if not city_key:
+            # The view rejects these without touching an upstream, so they skip
+            # admission and don't feed the latency signal.
+            return view(*args, **kwargs)
+
+        if not admission.acquire():
+            cached = lookup_stale(city_key)
+            if cached is not None:
+                stored_at, data = cached
+                with admission.cond:
+                    admission.stale_served_total += 1
+                response = jsonify(data)
+                response.headers['Age'] = str(int(time.time() - stored_at))
+                response.headers['Warning'] = '110 - "Response is Stale"'
+                return response
+            response = jsonify({"error": "Server is busy, please try again shortly."})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+            return response
+
+        start = time.monotonic()
+        upstream_ok = False
+        try:
+            response = app.make_response(view(*args, **kwargs))
+            upstream_ok = response.status_code < 500
+        finally:
+            admission.release(time.monotonic() - start, upstream_ok)
+
+        if response.status_code == 200:
+            remember_response(city_key, response.get_json())
+        return response
+    return wrapper
+
 # --- API Endpoint 1: The Data (Handles API calls) ---
 @app.route('/api/weather')
+@admission_controlled
 def get_weather_data():
-    city_name = request.args.get('city')
+    city_name = (request.args.get('city') or '').strip()
     if not city_name:
         return jsonify({"error": "A 'city' query parameter is required."}), 400
 
     # 1. Fetch Core Weather (OWM)
     owm_params = {'q': city_name, 'units': UNITS, 'appid': OWM_API_KEY}
     try:
-        weather_response = requests.get(OWM_WEATHER_URL, params=owm_params)
+        weather_response = requests.get(OWM_WEATHER_URL, params=owm_params, timeout=UPSTREAM_TIMEOUT)
         weather_response.raise_for_status()
         weather_data = weather_response.json()
     except requests.exceptions.HTTPError as err:
@@ -47,11 +237,11 @@ def get_weather_data():
     aqi_data, uvi_value = {}, None
     try:
         aqi_params = {'latitude': lat, 'longitude': lon, 'hourly': 'us_aqi,pm2_5'}
-        aqi_response = requests.get(OM_AQI_URL, params=aqi_params)
+        aqi_response = requests.get(OM_AQI_URL, params=aqi_params, timeout=UPSTREAM_TIMEOUT)
         aqi_data = aqi_response.json()
 
         uv_params = {'latitude': lat, 'longitude': lon, 'current': 'uv_index', 'forecast_days': 1}
-        uv_response = requests.get(OM_UV_URL, params=uv_params)
+        uv_response = requests.get(OM_UV_URL, params=uv_params, timeout=UPSTREAM_TIMEOUT)
         uvi_value = uv_response.json().get('current', {}).get('uv_index')
     except Exception as e:
         print(f"Warning: Could not fetch secondary data. Error: {e}")
@@ -82,6 +272,12 @@ def get_weather_data():
     return jsonify(final_data)
 
 
+# --- Admission control metrics (Prometheus text format) ---
+@app.route('/metrics')
+def metrics():
+    return Response(admission.metrics_text(), mimetype='text/plain; version=0.0.4')
+
+
 # --- API Endpoint 2: The Website (Serves the HTML/CSS/JS) ---
 @app.route('/')
 def home():